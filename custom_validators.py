@@ -0,0 +1,190 @@
+import os
+import re
+import threading
+from typing import Any, Dict, List
+
+from guardrails.validator_base import (
+    FailResult,
+    PassResult,
+    ValidationResult,
+    Validator,
+    register_validator,
+)
+
+try:
+    import hyperscan
+except ImportError:  # wheels exist for Linux x86_64 only
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+TOXIC_ONNX_MODEL_DIR = os.getenv("TOXIC_ONNX_MODEL_DIR")
+GUARD_DEVICE = os.getenv("GUARD_DEVICE", "auto")
+PROFANITY_WORDLIST = os.getenv("PROFANITY_WORDLIST")
+
+# ---------- PII Patterns ----------
+PII_PATTERNS = {
+    "EMAIL_ADDRESS": r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}",
+    # Either "+<country code>" followed by 2-4 digit groups, or a separated 3-3-4 number
+    # ("(555) 123-4567", "555.123.4567"). Bare digit runs, ISO dates, decimals, years and
+    # ISBNs do not match; the tradeoff is that unseparated local numbers ("5551234567")
+    # are missed. Hyperscan has no lookbehind, so only \b anchors are used.
+    "PHONE_NUMBER": r"\+\d{1,3}(?:[\s.-]?\d{2,5}){2,4}\b|(?:\(\d{3}\)\s?|\b\d{3}[\s.-])\d{3}[\s.-]\d{4}\b",
+}
+
+
+@register_validator(name="local/fast_pii", data_type="string")
+class FastPII(Validator):
+    """Pattern-based PII check; all entity patterns are compiled into one Hyperscan database."""
+
+    def __init__(self, entities: List[str], on_fail=None, **kwargs):
+        super().__init__(on_fail=on_fail, entities=entities, **kwargs)
+        self.entities = list(entities)
+        patterns = [PII_PATTERNS[entity] for entity in self.entities]
+        self._db = None
+        self._regexes = []
+        if hyperscan is not None:
+            self._db = hyperscan.Database()
+            self._db.compile(
+                expressions=[pattern.encode() for pattern in patterns],
+                ids=list(range(len(patterns))),
+                # Scanned input is always str.encode("utf-8"), so UTF-8 mode is safe
+                flags=[hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_UTF8] * len(patterns),
+            )
+            # A database shares one scratch space, so scans must not overlap
+            self._scan_lock = threading.Lock()
+        else:
+            self._regexes = [re.compile(pattern) for pattern in patterns]
+
+    def _find_entities(self, text: str) -> List[str]:
+        if self._db is None:
+            return [entity for entity, regex in zip(self.entities, self._regexes) if regex.search(text)]
+        found = []
+
+        def on_match(pattern_id, start, end, flags, context):
+            found.append(self.entities[pattern_id])
+
+        with self._scan_lock:
+            self._db.scan(text.encode("utf-8"), match_event_handler=on_match)
+        return found
+
+    def validate(self, value: Any, metadata: Dict = {}) -> ValidationResult:
+        found = self._find_entities(value)
+        if found:
+            return FailResult(
+                error_message=f"The following text in your response contains PII ({', '.join(found)}):\n{value}"
+            )
+        return PassResult()
+
+
+# ---------- Toxicity (ONNX int8) ----------
+# Label set of unitary/unbiased-toxic-roberta, the model behind hub ToxicLanguage
+TOXIC_LABELS = {
+    "toxicity", "severe_toxicity", "obscene", "threat", "insult", "identity_attack", "sexual_explicit",
+}
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+@register_validator(name="local/onnx_toxic_language", data_type="string")
+class OnnxToxicLanguage(Validator):
+    """Sentence-level ToxicLanguage on an int8 ONNX export (see export_toxic_onnx.py)."""
+
+    def __init__(self, model_dir: str, threshold: float = 0.5, on_fail=None, **kwargs):
+        super().__init__(on_fail=on_fail, model_dir=model_dir, threshold=threshold, **kwargs)
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer, pipeline
+
+        model = ORTModelForSequenceClassification.from_pretrained(model_dir, file_name="model_quantized.onnx")
+        self._pipe = pipeline(
+            "text-classification",
+            model=model,
+            tokenizer=AutoTokenizer.from_pretrained(model_dir),
+            function_to_apply="sigmoid",
+            top_k=None,
+            truncation=True,
+        )
+        self.threshold = threshold
+
+    def validate(self, value: Any, metadata: Dict = {}) -> ValidationResult:
+        sentences = [sentence for sentence in SENTENCE_SPLIT.split(value) if sentence.strip()]
+        if not sentences:
+            return PassResult()
+        toxic = [
+            sentence
+            for sentence, scores in zip(sentences, self._pipe(sentences))
+            if any(score["label"] in TOXIC_LABELS and score["score"] > self.threshold for score in scores)
+        ]
+        if toxic:
+            return FailResult(
+                error_message="The following sentences in your response were found to be toxic:\n\n- " + "\n- ".join(toxic)
+            )
+        return PassResult()
+
+
+def toxicity_validator():
+    """(validator, kwargs) for Guard.use: hub ToxicLanguage, or OnnxToxicLanguage when TOXIC_ONNX_MODEL_DIR is set."""
+    if TOXIC_ONNX_MODEL_DIR:
+        return OnnxToxicLanguage, {"model_dir": TOXIC_ONNX_MODEL_DIR}
+    from guardrails.hub import ToxicLanguage
+
+    return ToxicLanguage, {"validation_method": "sentence", "device": guard_device()}
+
+
+def guard_device() -> str:
+    """Torch device for transformer validators; GUARD_DEVICE=auto picks CUDA when present."""
+    if GUARD_DEVICE != "auto":
+        return GUARD_DEVICE
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+# ---------- Profanity (wordlist) ----------
+@register_validator(name="local/wordlist_profanity", data_type="string")
+class WordlistProfanity(Validator):
+    """Whole-word match against a profanity wordlist in one Aho-Corasick pass."""
+
+    def __init__(self, wordlist_path: str, on_fail=None, **kwargs):
+        super().__init__(on_fail=on_fail, wordlist_path=wordlist_path, **kwargs)
+        with open(wordlist_path, encoding="utf-8") as f:
+            words = {line.strip().lower() for line in f if line.strip() and not line.startswith("#")}
+        self._automaton = None
+        self._regex = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word in words:
+                self._automaton.add_word(word, len(word))
+            self._automaton.make_automaton()
+        else:
+            alternation = "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+            self._regex = re.compile(rf"(?<!\w)(?:{alternation})(?!\w)")
+
+    def _contains_profanity(self, text: str) -> bool:
+        lowered = text.lower()
+        if self._automaton is None:
+            return self._regex.search(lowered) is not None
+        for end, length in self._automaton.iter(lowered):
+            start = end - length + 1
+            # Only whole words count, so "class" does not match "ass"
+            if (start == 0 or not lowered[start - 1].isalnum()) and (
+                end + 1 == len(lowered) or not lowered[end + 1].isalnum()
+            ):
+                return True
+        return False
+
+    def validate(self, value: Any, metadata: Dict = {}) -> ValidationResult:
+        if self._contains_profanity(value):
+            return FailResult(error_message=f"{value} contains profanity. Please return profanity-free output.")
+        return PassResult()
+
+
+def profanity_validator():
+    """(validator, kwargs) for Guard.use: hub ProfanityFree, or WordlistProfanity when PROFANITY_WORDLIST is set."""
+    if PROFANITY_WORDLIST:
+        return WordlistProfanity, {"wordlist_path": PROFANITY_WORDLIST}
+    from guardrails.hub import ProfanityFree
+
+    return ProfanityFree, {}
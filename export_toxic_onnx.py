@@ -0,0 +1,30 @@
+"""Export the ToxicLanguage model to ONNX and quantize it to dynamic int8.
+
+    pip install "optimum[onnxruntime]"
+    python export_toxic_onnx.py models/toxic-onnx
+    TOXIC_ONNX_MODEL_DIR=models/toxic-onnx python guardserver.py
+"""
+import sys
+
+from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_NAME = "unitary/unbiased-toxic-roberta"
+
+
+def export(output_dir: str):
+    model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(MODEL_NAME).save_pretrained(output_dir)
+    # Writes model_quantized.onnx next to the fp32 export; VNNI falls back to plain int8 on older CPUs
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=output_dir,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False),
+    )
+    print(f"✅ Quantized model written to {output_dir}")
+
+
+if __name__ == "__main__":
+    export(sys.argv[1] if len(sys.argv) > 1 else "models/toxic-onnx")
@@ -0,0 +1,110 @@
+import os
+import queue
+import sys
+import threading
+import time
+
+import msgspec
+
+
+# ---------- Wire Format (newline-delimited JSON over stdin/stdout) ----------
+class WorkerRequest(msgspec.Struct, array_like=True, gc=False):
+    id: int
+    text: str
+    solo: bool = False  # score on its own, never joined with other requests
+
+
+class WorkerResult(msgspec.Struct, array_like=True, gc=False):
+    id: int
+    error: str | None = None
+    crashed: bool = False  # `error` is an exception from the model, not a FailResult
+
+
+BATCH_MAX = int(os.getenv("GUARD_BATCH_MAX", "16"))
+BATCH_WAIT_SECONDS = float(os.getenv("GUARD_BATCH_WAIT_SECONDS", "0.01"))
+HALF_PRECISION = os.getenv("GUARD_HALF_PRECISION", "1") == "1"
+
+
+def build_validators():
+    import torch
+    from guardrails import Guard, OnFailAction
+    from custom_validators import toxicity_validator
+
+    validator, kwargs = toxicity_validator()
+    guard = Guard().use(validator, threshold=0.5, on_fail=OnFailAction.EXCEPTION, **kwargs)
+    validators = list(guard._validators)
+    if HALF_PRECISION and torch.cuda.is_available():
+        for validator in validators:
+            model = getattr(getattr(validator, "_model", None), "model", None)
+            if isinstance(model, torch.nn.Module) and next(model.parameters()).is_cuda:
+                model.half()
+    return validators
+
+
+def main():
+    import torch
+    from guardrails.validator_base import FailResult
+
+    # Protocol owns the real stdout; anything printed by libraries goes to stderr
+    out = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+
+    validators = build_validators()
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder(WorkerRequest)
+    requests = queue.Queue()
+
+    def read_requests():
+        for line in sys.stdin.buffer:
+            requests.put(decoder.decode(line))
+        requests.put(None)
+
+    threading.Thread(target=read_requests, name="GuardWorkerReader", daemon=True).start()
+
+    def check(text):
+        """(error, crashed) for `text`; error is None when every validator passes."""
+        for validator in validators:
+            try:
+                result = validator.validate(text, {})
+            except Exception as e:
+                return f"{type(e).__name__}: {e}", True
+            if isinstance(result, FailResult):
+                return result.error_message, False
+        return None, False
+
+    while True:
+        first = requests.get()
+        if first is None:
+            return
+        batch = [first]
+        deadline = time.monotonic() + BATCH_WAIT_SECONDS
+        while len(batch) < BATCH_MAX:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                requests.put(None)
+                break
+            batch.append(item)
+
+        with torch.inference_mode():
+            # One forward for the joinable requests; re-run singly only if something failed
+            joinable = [req for req in batch if not req.solo]
+            errors = {}
+            if len(joinable) > 1 and check("\n".join(req.text for req in joinable)) == (None, False):
+                errors = {req.id: (None, False) for req in joinable}
+            for req in batch:
+                if req.id not in errors:
+                    errors[req.id] = check(req.text)
+        for req in batch:
+            error, crashed = errors[req.id]
+            out.write(encoder.encode(WorkerResult(req.id, error, crashed)) + b"\n")
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
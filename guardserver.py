@@ -1,264 +1,830 @@
 import asyncio
 import json
 import logging
+import re
 import time
 import threading
 import queue
+import subprocess
+import sys
+import itertools
+import hashlib
+from collections import OrderedDict
+import os
+
+# In-process toxicity inference is serialized on the GuardBatcher thread, so torch keeps
+# its default intra-op threads. TORCH_THREADS caps them (e.g. when several servers share
+# a host); it must be applied before torch/transformers load.
+TORCH_THREADS = os.getenv("TORCH_THREADS")
+if TORCH_THREADS:
+    os.environ.setdefault("OMP_NUM_THREADS", TORCH_THREADS)
+    os.environ.setdefault("MKL_NUM_THREADS", TORCH_THREADS)
+
+import msgspec
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import websockets as ws_client
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, NamedTuple
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from guardrails import Guard, OnFailAction
-from guardrails.hub import ToxicLanguage, ProfanityFree, DetectPII
-import spacy
+from guardrails.errors import ValidationError
+from guardrails.validator_base import FailResult
+import torch
+if TORCH_THREADS:
+    # Safe to repeat when uvicorn re-imports this module; set_num_interop_threads is not
+    torch.set_num_threads(int(TORCH_THREADS))
+from custom_validators import FastPII, profanity_validator, toxicity_validator
+from guard_worker import WorkerRequest, WorkerResult
 from logging_config import setup_logging, get_guardrails_logger
+from sentence_stream import MAX_BUFFER_CHARS, SENTENCE_CLOSERS, SENTENCE_END, assemble_sentences
 from router_agent import router
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
 SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL")
+GUARD_HALF_PRECISION = os.getenv("GUARD_HALF_PRECISION", "1") == "1"
+GUARD_WORKER_PROCESS = os.getenv("GUARD_WORKER_PROCESS", "0") == "1"
+TOXIC_FASTTEXT_MODEL = os.getenv("TOXIC_FASTTEXT_MODEL")
 
 # ---------- Email Configuration (SendGrid) ----------
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+# One pooled keep-alive session so repeated alerts reuse the TLS connection
+_sg_session = requests.Session()
+_sg_session.headers.update({
+    "Authorization": f"Bearer {SENDGRID_API_KEY}",
+    "Content-Type": "application/json",
+})
+_sg_session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2)),
+)
 
 
 # ---------- Email Helper (SendGrid API) ----------
-def send_violation_email(subject: str, body: str, recipient: str = ADMIN_EMAIL):
-    url = "https://api.sendgrid.com/v3/mail/send"
-    headers = {
-        "Authorization": f"Bearer {SENDGRID_API_KEY}",  # ← SPACE after 'Bearer'
-        "Content-Type": "application/json"
-    }
+EMAIL_DEDUPE_SECONDS = 60
+EMAIL_BATCH_WINDOW_SECONDS = 1.0
+_email_queue = queue.Queue()
+_email_last_sent = {}
+_email_suppressed = {}
+
+
+def send_violation_email(subject: str, body: str, recipient: str = ADMIN_EMAIL, dedupe_key: str = ""):
+    """Queue an alert for the background sender so guards never wait on SendGrid.
+
+    Alerts with the same subject, recipient and `dedupe_key` (default: the body) are sent at
+    most once per EMAIL_DEDUPE_SECONDS; repeats are summarised when the window closes.
+    """
+    _email_queue.put((subject, body, recipient, dedupe_key or body))
+
+
+def _email_worker():
+    # Alerts arriving within one window go out as a single SendGrid request; the idle
+    # timeout also lets repeat summaries go out when their window closes
+    while True:
+        try:
+            pending = [_email_queue.get(timeout=EMAIL_BATCH_WINDOW_SECONDS)]
+        except queue.Empty:
+            pending = []
+        deadline = time.monotonic() + EMAIL_BATCH_WINDOW_SECONDS
+        while pending:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(_email_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        alerts = [alert for alert in (_dedupe_alert(*item) for item in pending) if alert]
+        alerts.extend(_expired_repeats())
+        if alerts:
+            _post_email(alerts)
+
+
+def _dedupe_alert(subject: str, body: str, recipient: str, dedupe_key: str):
+    key = (subject, recipient, hashlib.blake2b(dedupe_key.encode("utf-8"), digest_size=16).digest())
+    now = time.monotonic()
+    last = _email_last_sent.get(key)
+    if last is not None and now - last < EMAIL_DEDUPE_SECONDS:
+        count = _email_suppressed.get(key, (0,))[0]
+        _email_suppressed[key] = (count + 1, subject, body, recipient)
+        log.warning("📪 Suppressed repeat alert %r for %s", subject, recipient)
+        return None
+    _email_last_sent[key] = now
+    return subject, body, recipient
+
+
+def _expired_repeats():
+    # Closed dedupe windows: summarise their suppressed repeats and forget the rest
+    now = time.monotonic()
+    summaries = []
+    for key, last in list(_email_last_sent.items()):
+        if now - last < EMAIL_DEDUPE_SECONDS:
+            continue
+        suppressed = _email_suppressed.pop(key, None)
+        if suppressed is None:
+            del _email_last_sent[key]
+            continue
+        count, subject, body, recipient = suppressed
+        _email_last_sent[key] = now
+        summaries.append((
+            subject,
+            f"{body.strip()}\n\n(repeated {count} more time(s) in the previous {EMAIL_DEDUPE_SECONDS}s; latest shown)",
+            recipient,
+        ))
+    return summaries
+
+
+def _post_email(alerts: list):
+    recipients = list(dict.fromkeys(recipient for _, _, recipient in alerts))
+    if len(alerts) == 1:
+        subject, body = alerts[0][0], alerts[0][1].strip()
+    else:
+        subject = f"🚨 Guardrails: {len(alerts)} violations detected"
+        body = "\n\n----------\n\n".join(f"{alert_subject}\n{alert_body.strip()}" for alert_subject, alert_body, _ in alerts)
     data = {
-        "personalizations": [{"to": [{"email": recipient}]}],
+        "personalizations": [{"to": [{"email": recipient}]} for recipient in recipients],
         "from": {"email": SENDGRID_FROM_EMAIL},
         "subject": subject,
-        "content": [{"type": "text/plain", "value": body.strip()}]
+        "content": [{"type": "text/plain", "value": body}]
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=10)
-        log.info(f"📤 SendGrid API request sent. Status: {response.status_code}")
+        response = _sg_session.post(SENDGRID_URL, json=data, timeout=10)
+        log.info("📤 SendGrid API request sent. Status: %s", response.status_code)
         if response.status_code == 202:
-            log.info(f"✅ Email accepted by SendGrid for {recipient}")
+            log.info("✅ Email with %d alert(s) accepted by SendGrid for %s", len(alerts), ", ".join(recipients))
         else:
-            log.error(f"❌ SendGrid API error {response.status_code}: {response.text}")
+            log.error("❌ SendGrid API error %s: %s", response.status_code, response.text)
             # Log full request for debugging (temporarily)
-            log.debug(f"Request payload: {json.dumps(data, indent=2)}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Request payload: %s", json.dumps(data, indent=2))
     except requests.exceptions.Timeout:
         log.error("❌ SendGrid request timed out")
     except requests.exceptions.RequestException as e:
-        log.exception(f"❌ Network error sending email: {e}")
+        log.exception("❌ Network error sending email: %s", e)
     except Exception as e:
-        log.exception(f"❌ Unexpected error in send_violation_email: {e}")
+        log.exception("❌ Unexpected error in _post_email: %s", e)
 
-# ---------- NLP + Guard Setup ----------
-nlp = spacy.load("en_core_web_sm")
 
-setup_logging()
-log = get_guardrails_logger()
+threading.Thread(target=_email_worker, name="EmailSender", daemon=True).start()
 
-guard_output_complete = (
-    Guard()
-    .use(ToxicLanguage, threshold=0.5, validation_method="sentence", on_fail=OnFailAction.EXCEPTION)
-    .use(ProfanityFree, on_fail="exception")
-)
 
-guard_input = (
-    Guard()
-    .use(ToxicLanguage, threshold=0.5, validation_method="sentence", on_fail=OnFailAction.EXCEPTION)
-    .use(DetectPII, entities=["EMAIL_ADDRESS", "PHONE_NUMBER"], on_fail="exception")
-    .use(ProfanityFree, on_fail="exception")
-)
+# ---------- Wire Format (msgspec) ----------
+class TokenMsg(msgspec.Struct, gc=False):
+    token: str | None | msgspec.UnsetType = msgspec.UNSET
+    tokens: list[str] | msgspec.UnsetType = msgspec.UNSET
+    error: str | msgspec.UnsetType = msgspec.UNSET
+    response: str | msgspec.UnsetType = msgspec.UNSET
 
-MAX_BUFFER_CHARS = 200
-MAX_WAIT_SECONDS = 3
-executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="Validator")
-
-
-# ---------- Sentence Assembly ----------
-def extract_complete_sentences_spacy(raw_text: str):
-    if not raw_text.strip():
-        return "", raw_text
-    doc = nlp(raw_text)
-    sentences = list(doc.sents)
-    if not sentences:
-        return "", raw_text
-    complete_end = 0
-    for sent in sentences:
-        stripped = sent.text.rstrip()
-        if stripped and stripped[-1] in ".!?":
-            complete_end = sent.end_char
-        else:
-            break
-    if complete_end > 0:
-        return raw_text[:complete_end], raw_text[complete_end:]
-    return "", raw_text
 
+class PromptMsg(msgspec.Struct, gc=False):
+    prompt: str = ""
+    username: str = ""
+    model: str = ""
+    guard: str = ""
 
-async def assemble_sentences(raw_token_queue, chunk_queue):
-    raw_buffer = ""
-    last_token_time = time.time()
-    chunk_seq = 0
-    while True:
-        try:
-            token = await asyncio.wait_for(raw_token_queue.get(), timeout=2.0)
-            if token is None:
-                if raw_buffer.strip():
-                    await chunk_queue.put((chunk_seq, raw_buffer, time.time(), False))
-                    chunk_seq += 1
-                await chunk_queue.put(None)
-                return
-            raw_buffer += token
-            last_token_time = time.time()
-            complete, remaining = extract_complete_sentences_spacy(raw_buffer)
-            if complete:
-                await chunk_queue.put((chunk_seq, complete, time.time(), True))
-                chunk_seq += 1
-                raw_buffer = remaining
+
+_token_decoder = msgspec.json.Decoder(TokenMsg)
+_prompt_decoder = msgspec.json.Decoder(PromptMsg)
+_json_encoder = msgspec.json.Encoder()
+
+
+async def send_obj(ws: WebSocket, obj: dict):
+    await ws.send_bytes(_json_encoder.encode(obj))
+
+# ---------- Guard Setup ----------
+setup_logging()
+log = get_guardrails_logger()
+
+def use_half_precision(guard):
+    # Detoxify/HF pipelines keep their torch module on `_model.model`
+    for validator in getattr(guard, "_validators", []):
+        model = getattr(getattr(validator, "_model", None), "model", None)
+        if isinstance(model, torch.nn.Module) and next(model.parameters()).is_cuda:
+            model.half()
+
+
+def freeze_guard(guard):
+    """Bind a guard's validators into one callable, skipping Guard's per-call history and outcome bookkeeping."""
+    validators = list(guard._validators)
+
+    def validate(text: str):
+        for validator in validators:
+            result = validator.validate(text, {})
+            if isinstance(result, FailResult):
+                raise ValidationError(f"Validation failed for field with errors: {result.error_message}")
+
+    return validate
+
+GUARD_BATCH_MAX = 16
+GUARD_BATCH_SIZE = int(os.getenv("GUARD_BATCH_SIZE", "8"))
+GUARD_BATCH_WINDOW_SECONDS = float(os.getenv("GUARD_BATCH_WINDOW_MS", "50")) / 1000
+GUARD_BATCH_WAIT_SECONDS = 0.01
+RAW_TOKEN_QUEUE_SIZE = 256
+CHUNK_QUEUE_SIZE = 32
+WRITE_QUEUE_SIZE = 64
+WRITE_BATCH_MAX = 64
+TOKEN_COALESCE_CHARS = 32
+TOKEN_COALESCE_SECONDS = 0.005
+OUTPUT_CACHE_SIZE = 4096
+OUTPUT_CACHE_REPORT_EVERY = 1000
+INPUT_CACHE_SIZE = 4096
+MODEL_POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", "8"))
+HAS_WORDS = re.compile(r"\w")
+GUARD_WORKERS = int(os.getenv("GUARD_WORKERS", str(min(32, (os.cpu_count() or 4) * 2))))
+# Per-connection cap so one client cannot occupy the whole shared pool
+GUARD_MAX_INFLIGHT = int(os.getenv("GUARD_MAX_INFLIGHT", "4"))
+executor = ThreadPoolExecutor(max_workers=GUARD_WORKERS, thread_name_prefix="Validator")
+
+
+async def _run_in_pool(func, *args):
+    # Plain run_in_executor: unlike asyncio.to_thread it skips the contextvars copy per call
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+# ---------- Cross-Session Guard Batching ----------
+class GuardBatcher:
+    """Collects validate calls from every session and runs them as one guard call per tick."""
+
+    def __init__(self, validate, max_batch: int = GUARD_BATCH_MAX, max_wait: float = GUARD_BATCH_WAIT_SECONDS):
+        self._validate = validate
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="GuardBatcher", daemon=True)
+        self._thread.start()
+
+    def validate(self, text: str, solo: bool = False):
+        """Block until `text` is validated; raises the guard's error if it fails.
+
+        `solo` texts are always scored on their own: a prompt without final punctuation
+        would otherwise merge into a neighbour's sentence and have its score diluted.
+        """
+        future = Future()
+        self._requests.put((text, future, solo))
+        future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._validate_batch(batch)
+
+    def _validate_batch(self, batch):
+        joinable = [item for item in batch if not item[2]]
+        if len(joinable) > 1:
+            try:
+                with torch.inference_mode():
+                    self._validate("\n".join(text for text, _, _ in joinable))
+            except Exception:
+                pass  # re-run one by one so only the offending session fails
             else:
-                now = time.time()
-                should_flush = (
-                    (now - last_token_time >= MAX_WAIT_SECONDS)
-                    or (len(raw_buffer) >= MAX_BUFFER_CHARS)
+                for _, future, _ in joinable:
+                    future.set_result(None)
+                batch = [item for item in batch if item[2]]
+        for text, future, _ in batch:
+            try:
+                with torch.inference_mode():
+                    self._validate(text)
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+
+
+class GuardWorkerClient:
+    """GuardBatcher drop-in that forwards texts to a single guard_worker.py process owning the model."""
+
+    def __init__(self):
+        self._process = None
+        # Pending futures of the current process only, so a restart never fails new requests
+        self._futures = {}
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._encoder = msgspec.json.Encoder()
+
+    def _ensure_started(self):
+        # Spawned lazily so importing this module never forks a model process
+        with self._start_lock:
+            if self._process is None or self._process.poll() is not None:
+                self._futures = {}
+                self._process = subprocess.Popen(
+                    [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "guard_worker.py")],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
                 )
-                if should_flush and raw_buffer.strip():
-                    await chunk_queue.put((chunk_seq, raw_buffer, now, False))
-                    chunk_seq += 1
-                    raw_buffer = ""
-                    last_token_time = now
-        except asyncio.TimeoutError:
-            if raw_buffer.strip():
-                await chunk_queue.put((chunk_seq, raw_buffer, time.time(), False))
-                chunk_seq += 1
-                raw_buffer = ""
+                threading.Thread(
+                    target=self._read_results,
+                    args=(self._process, self._futures),
+                    name="GuardWorkerResults",
+                    daemon=True,
+                ).start()
+                log.info("🧵 Guard worker process started (pid %s)", self._process.pid)
+            return self._process, self._futures
+
+    def validate(self, text: str, solo: bool = False):
+        """Block until `text` is validated; raises ValidationError if it fails."""
+        process, futures = self._ensure_started()
+        future = Future()
+        request_id = next(self._ids)
+        futures[request_id] = future
+        try:
+            with self._write_lock:
+                process.stdin.write(self._encoder.encode(WorkerRequest(request_id, text, solo)) + b"\n")
+                process.stdin.flush()
+        except (OSError, ValueError) as e:
+            # Worker died (broken pipe / closed stdin); the next call starts a fresh one
+            futures.pop(request_id, None)
+            raise RuntimeError("Guard worker process is not running") from e
+        future.result()
+
+    def _read_results(self, process, futures):
+        decoder = msgspec.json.Decoder(WorkerResult)
+        for line in process.stdout:
+            result = decoder.decode(line)
+            future = futures.pop(result.id, None)
+            if future is None:
+                continue
+            if result.error is None:
+                future.set_result(None)
+            elif result.crashed:
+                # Not a verdict: callers must neither cache it nor report it as a violation
+                future.set_exception(RuntimeError(f"Guard worker error: {result.error}"))
+            else:
+                future.set_exception(ValidationError(f"Validation failed for field with errors: {result.error}"))
+        log.error("❌ Guard worker process exited with code %s", process.wait())
+        for request_id in list(futures):
+            future = futures.pop(request_id, None)
+            if future is not None:
+                future.set_exception(RuntimeError("Guard worker process exited"))
+
+
+class FastTextPrefilter:
+    """Settles clear-cut texts with a quantized fastText classifier and sends only the uncertain band on to `inner`."""
+
+    def __init__(self, model_path: str, inner, pass_below: float = 0.3, fail_above: float = 0.9):
+        import fasttext
+
+        self._model = fasttext.load_model(model_path)
+        self._inner = inner
+        self.pass_below = pass_below
+        self.fail_above = fail_above
+
+    def validate(self, text: str, solo: bool = False):
+        labels, probs = self._model.predict(text.replace("\n", " "), k=2)
+        toxic = dict(zip(labels, probs)).get("__label__toxic", 0.0)
+        if toxic < self.pass_below:
+            return
+        if toxic > self.fail_above:
+            raise ValidationError(
+                f"Validation failed for field with errors: The following text was found to be toxic ({toxic:.2f}):\n\n{text}"
+            )
+        self._inner.validate(text, solo)
+
+
+# ---------- Lazy Guard Construction ----------
+class GuardSet(NamedTuple):
+    input_rules: Callable[[str], None]
+    output_profanity: Callable[[str], None]
+    toxicity: Any  # GuardBatcher, GuardWorkerClient or FastTextPrefilter
+
+
+_guards = None
+_guards_lock = threading.Lock()
+
+
+def build_guards() -> GuardSet:
+    toxicity_cls, toxicity_kwargs = toxicity_validator()
+    profanity_cls, profanity_kwargs = profanity_validator()
+
+    # One instance per model, shared by every guard that uses it. ToxicLanguage scores
+    # each sentence on its own, so it runs through the cross-session batcher for both
+    # input and output; ProfanityFree scores the whole text and stays per-call.
+    # With GUARD_WORKER_PROCESS the toxicity model lives in guard_worker.py instead.
+    profanity = profanity_cls(on_fail="exception", **profanity_kwargs)
+    guard_output_profanity = Guard().use(profanity)
+
+    # Cheapest validators first so obvious violations fail before the transformer runs
+    guard_input = (
+        Guard()
+        .use(profanity)
+        .use(FastPII, entities=["EMAIL_ADDRESS", "PHONE_NUMBER"], on_fail="exception")
+    )
+
+    if GUARD_WORKER_PROCESS:
+        toxicity = GuardWorkerClient()
+    else:
+        guard_output_toxicity = Guard().use(
+            toxicity_cls(threshold=0.5, on_fail=OnFailAction.EXCEPTION, **toxicity_kwargs)
+        )
+        if GUARD_HALF_PRECISION and torch.cuda.is_available():
+            torch.backends.cudnn.benchmark = True
+            use_half_precision(guard_output_toxicity)
+        toxicity = GuardBatcher(freeze_guard(guard_output_toxicity))
+
+    if TOXIC_FASTTEXT_MODEL:
+        toxicity = FastTextPrefilter(TOXIC_FASTTEXT_MODEL, toxicity)
+
+    return GuardSet(freeze_guard(guard_input), freeze_guard(guard_output_profanity), toxicity)
 
 
-async def dispatch_validations(chunk_queue, write_queue):
-    loop = asyncio.get_event_loop()
+def get_guards() -> GuardSet:
+    """Build the guards on first use so importing the app (and serving `/`) never waits on model loads."""
+    global _guards
+    if _guards is None:
+        with _guards_lock:
+            if _guards is None:
+                start = time.perf_counter()
+                _guards = build_guards()
+                log.info("🛡️ Guards built in %.2fs", time.perf_counter() - start)
+    return _guards
+
+
+def validate_input(prompt: str):
+    guards = get_guards()
+    guards.input_rules(prompt)
+    guards.toxicity.validate(prompt, solo=True)
+
+
+# Verdicts for recent prompts keyed by a 16-byte digest, so memory stays bounded however long prompts get
+_input_verdicts = OrderedDict()
+_input_verdicts_lock = threading.Lock()
+
+
+def validate_input_cached(prompt: str):
+    key = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+    with _input_verdicts_lock:
+        hit = key in _input_verdicts
+        if hit:
+            _input_verdicts.move_to_end(key)
+            error = _input_verdicts[key]
+    if not hit:
+        try:
+            validate_input(prompt)
+            error = None
+        except ValidationError as e:
+            error = str(e)
+        with _input_verdicts_lock:
+            _input_verdicts[key] = error
+            if len(_input_verdicts) > INPUT_CACHE_SIZE:
+                _input_verdicts.popitem(last=False)
+    if error is not None:
+        raise ValidationError(error)
+
+
+# ---------- Session Queues ----------
+class MonitoredQueue(asyncio.Queue):
+    """Bounded asyncio.Queue that logs once each time it fills past 90%."""
+
+    def __init__(self, name: str, maxsize: int):
+        super().__init__(maxsize)
+        self.name = name
+        self._congested = False
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        size = self.qsize()
+        if size >= self.maxsize * 0.9:
+            if not self._congested:
+                self._congested = True
+                log.warning("⚠️ %s queue congested (%d/%d)", self.name, size, self.maxsize)
+        elif size <= self.maxsize // 2:
+            self._congested = False
+
+
+async def dispatch_validations(chunk_queue, write_queue, abort_event: asyncio.Event):
+    loop = asyncio.get_running_loop()
     pending = set()
-    while True:
+    inflight = asyncio.Semaphore(GUARD_MAX_INFLIGHT)
+    stream_done = False
+    while not stream_done:
         item = await chunk_queue.get()
         if item is None:
-            if pending:
-                await asyncio.gather(*pending, return_exceptions=True)
-            write_queue.put(None)
             break
-        seq, text, recv_time, is_complete = item
-        task = loop.run_in_executor(
-            executor, validate_chunk_sync, seq, text, recv_time, is_complete, write_queue
-        )
+        if abort_event.is_set():
+            continue  # stream already failed; keep consuming so the assembler never blocks
+        # Fragments (is_complete=False) are forwarded unvalidated, as before, without a pool hop
+        if not item[3]:
+            await write_queue.put(("valid", item[0], item[1], item[2]))
+            continue
+        # Collect sentences for a short window so they share a single validate call
+        batch = [item]
+        batch_chars = len(item[1])
+        deadline = loop.time() + GUARD_BATCH_WINDOW_SECONDS
+        while batch_chars < MAX_BUFFER_CHARS and len(batch) < GUARD_BATCH_SIZE:
+            try:
+                timeout = deadline - loop.time()
+                if timeout > 0:
+                    item = await asyncio.wait_for(chunk_queue.get(), timeout)
+                else:
+                    item = chunk_queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if item is None:
+                stream_done = True
+                break
+            if not item[3]:
+                await write_queue.put(("valid", item[0], item[1], item[2]))
+                continue
+            batch.append(item)
+            batch_chars += len(item[1])
+        await inflight.acquire()
+        task = asyncio.create_task(validate_and_enqueue(batch, write_queue))
         pending.add(task)
-        if len(pending) > 4:
-            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        task.add_done_callback(pending.discard)
+        task.add_done_callback(lambda _: inflight.release())
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    await write_queue.put(None)
+
+
+async def validate_and_enqueue(batch: list, write_queue: asyncio.Queue):
+    # Results are queued from the loop, so the writer needs no thread hop per token
+    for result in await _run_in_pool(validate_batch_sync, batch):
+        await write_queue.put(result)
 
 
-def validate_chunk_sync(seq: int, text: str, recv_time: float, is_complete: bool, write_queue: queue.Queue):
+_output_cache_lookups = itertools.count()
+
+
+@lru_cache(maxsize=OUTPUT_CACHE_SIZE)
+def validate_output_cached(text: str, solo: bool = False):
+    # Guards are deterministic per text, so repeated sentences skip the models.
+    # Only verdicts are cached; unexpected errors propagate and are retried next time.
+    guards = get_guards()
+    try:
+        with torch.inference_mode():
+            guards.output_profanity(text)
+        guards.toxicity.validate(text, solo)
+    except ValidationError as e:
+        return str(e)
+    return None
+
+
+def validate_batch_sync(batch: list):
     thread_name = threading.current_thread().name
-    start = time.time()
-    log.info(f"[VALIDATION START] Seq={seq} | Complete={is_complete} | Chunk: {repr(text[:50])}...")
+    first_seq, last_seq = batch[0][0], batch[-1][0]
+    text = "".join(chunk for _, chunk, _, _ in batch)
+    start = time.perf_counter()
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("[VALIDATION START] Seq=%s-%s | Chunk: %.50r...", first_seq, last_seq, text)
     try:
-        if is_complete:
-            guard_output_complete.validate(text, on="output")
-        duration = time.time() - start
-        log.info(f"[VALIDATION PASS] Seq={seq} ({duration:.3f}s) by {thread_name}")
-        write_queue.put(("valid", seq, text, recv_time))
-        return True
-    except Exception as e:
-        duration = time.time() - start
-        log.error(f"[VALIDATION FAIL] Seq={seq} ({duration:.3f}s) by {thread_name} → {str(e)}")
+        # Whitespace/punctuation-only text cannot be toxic or profane
+        if HAS_WORDS.search(text):
+            # Whitespace-collapsed key so re-spaced repeats hit; case is kept since the model is cased
+            key = " ".join(text.split())
+            # Unterminated text (the stream's final remainder) must not be merged into another
+            # session's sentence by the batcher, or its score gets diluted
+            error = validate_output_cached(key, not key.rstrip(SENTENCE_CLOSERS).endswith((".", "!", "?")))
+            if next(_output_cache_lookups) % OUTPUT_CACHE_REPORT_EVERY == OUTPUT_CACHE_REPORT_EVERY - 1:
+                info = validate_output_cached.cache_info()
+                log.info("📊 Output guard cache: %d hits / %d misses (%d cached)", info.hits, info.misses, info.currsize)
+            if error is not None:
+                raise ValidationError(error)
+        if debug:
+            duration = time.perf_counter() - start
+            log.debug("[VALIDATION PASS] Seq=%s-%s (%.3fs) by %s", first_seq, last_seq, duration, thread_name)
+        return [("valid", seq, chunk, recv_time) for seq, chunk, recv_time, _ in batch]
+    except ValidationError as e:
+        duration = time.perf_counter() - start
+        log.error("[VALIDATION FAIL] Seq=%s-%s (%.3fs) by %s → %s", first_seq, last_seq, duration, thread_name, e)
 
         # 🚨 Send Email Alert via SendGrid
         subject = "🚨 Guardrails Output Violation Detected"
         body = f"""
         Violation detected in OUTPUT guard:
-        Sequence: {seq}
+        Sequence: {first_seq}-{last_seq}
         Thread: {thread_name}
         Text: {text[:200]}...
         Error: {str(e)}
         Timestamp: {time.ctime()}
         """
-        send_violation_email(subject, body)
+        send_violation_email(subject, body, dedupe_key=text)
 
-        write_queue.put(("fail", seq, text, recv_time))
-        return False
+        return [("fail", first_seq, text, batch[0][2])]
+    except Exception:
+        # Guard itself broke (model crash, worker exit): fail closed, but it is no violation
+        log.exception("💥 Output guard error on Seq=%s-%s by %s", first_seq, last_seq, thread_name)
+        return [("fail", first_seq, text, batch[0][2])]
 
 
-def websocket_writer(write_queue: queue.Queue, ws: WebSocket, main_loop):
+async def websocket_writer(write_queue: asyncio.Queue, ws: WebSocket, abort_event: asyncio.Event):
     expected_seq = 0
     pending = {}
+    aborted = False
+    finished = False
+    while not finished:
+        # Everything already queued goes out as one {"tokens": [...]} frame
+        items = [await write_queue.get()]
+        while len(items) < WRITE_BATCH_MAX and not write_queue.empty():
+            items.append(write_queue.get_nowait())
+        tokens = []
+        try:
+            for item in items:
+                if item is None:
+                    finished = True
+                    break
+                if aborted:
+                    continue  # keep draining so validators never block on a full queue
+                status, seq, text, ts = item
+                if status == "fail":
+                    if tokens:
+                        await send_obj(ws, {"tokens": tokens})
+                        tokens = []
+                    log.error("❌ Validation failed → aborting stream")
+                    await send_obj(ws, {"error": "Guard validation failed on output"})
+                    aborted = True
+                    abort_event.set()
+                elif seq == expected_seq:
+                    tokens.append(text)
+                    expected_seq += 1
+                    while expected_seq in pending:
+                        txt, _ = pending.pop(expected_seq)
+                        tokens.append(txt)
+                        expected_seq += 1
+                else:
+                    pending[seq] = (text, ts)
+            if not aborted:
+                if tokens:
+                    await send_obj(ws, {"tokens": tokens})
+                if finished:
+                    await send_obj(ws, {"token": None})
+        except Exception as exc:
+            log.warning("⚠️ Send to client failed, dropping rest of stream: %s", exc)
+            aborted = True
+            abort_event.set()
+
+
+# ---------- Model Server Connection Pool ----------
+class ModelConnectionPool:
+    """Keeps idle model-server websockets per URL so each prompt skips the handshake."""
+
+    def __init__(self, max_idle: int = MODEL_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = {}
+
+    async def send(self, url: str, message: str):
+        idle = self._idle.setdefault(url, [])
+        while idle:
+            conn = idle.pop()
+            if conn.close_code is not None:
+                continue
+            try:
+                await conn.send(message)
+                return conn
+            except ws_client.ConnectionClosed:
+                continue
+        # Token frames are tiny and the link is local; permessage-deflate only costs CPU
+        conn = await ws_client.connect(url, compression=None, max_size=2**20)
+        await conn.send(message)
+        return conn
+
+    async def release(self, url: str, conn, reusable: bool):
+        # Only a connection whose response was fully read can serve the next prompt
+        idle = self._idle.setdefault(url, [])
+        if reusable and conn.close_code is None and len(idle) < self.max_idle:
+            idle.append(conn)
+        else:
+            await conn.close()
 
-    def safe_send(data):
-        asyncio.run_coroutine_threadsafe(ws.send_json(data), main_loop)
 
-    while True:
-        item = write_queue.get()
-        if item is None:
-            safe_send({"token": None})
-            break
-        status, seq, text, ts = item
-        if status == "fail":
-            log.error("❌ Validation failed → aborting stream")
-            safe_send({"error": "Guard validation failed on output"})
-            while not write_queue.empty():
-                try:
-                    write_queue.get_nowait()
-                except queue.Empty:
-                    pass
-            break
-        if seq == expected_seq:
-            safe_send({"token": text})
-            expected_seq += 1
-            while expected_seq in pending:
-                txt, _ = pending.pop(expected_seq)
-                safe_send({"token": txt})
-                expected_seq += 1
-        else:
-            pending[seq] = (text, ts)
-        write_queue.task_done()
+model_pool = ModelConnectionPool()
 
 
-async def stream_producer(payload: dict, url: str, raw_token_queue: asyncio.Queue):
+async def stream_producer(payload: dict, url: str, raw_token_queue: asyncio.Queue, abort_event: asyncio.Event):
     log.info("🚀 Connecting to model server...")
+    model_ws = None
+    reusable = False
+    # Tokens are coalesced locally and enqueued as one string per sentence end,
+    # TOKEN_COALESCE_CHARS, or TOKEN_COALESCE_SECONDS of model silence
+    pending = []
+    pending_len = 0
     try:
-        async with ws_client.connect(url) as model_ws:
-            await model_ws.send(json.dumps(payload))
-            log.info("📤 Prompt sent")
-            async for msg in model_ws:
-                data = json.loads(msg)
-                if "token" in data:
-                    token = data["token"]
-                    if token is None:
-                        await raw_token_queue.put(None)
-                        log.info("🔚 End of stream")
-                        return
-                    await raw_token_queue.put(token)
-                elif "error" in data:
-                    log.error(f"💥 Model error: {data['error']}")
+        # Model server reads the prompt with receive_json, so keep it a text frame
+        model_ws = await model_pool.send(url, _json_encoder.encode(payload).decode())
+        log.info("📤 Prompt sent")
+        while True:
+            try:
+                if pending:
+                    # Cancelling recv() is safe: an interrupted frame is delivered on the next call
+                    msg = await asyncio.wait_for(model_ws.recv(), TOKEN_COALESCE_SECONDS)
+                else:
+                    msg = await model_ws.recv()
+            except asyncio.TimeoutError:
+                await raw_token_queue.put("".join(pending))
+                pending.clear()
+                pending_len = 0
+                continue
+            except ws_client.ConnectionClosedOK:
+                break
+            if abort_event.is_set():
+                # Mid-stream, so the connection is closed rather than pooled
+                log.info("🛑 Output rejected, stopping model stream")
+                break
+            data = _token_decoder.decode(msg)
+            if data.tokens is not msgspec.UNSET:
+                # Batched frame from the model server; coalesced like single tokens
+                pending.extend(data.tokens)
+                pending_len += sum(map(len, data.tokens))
+                if pending_len >= TOKEN_COALESCE_CHARS or any(SENTENCE_END.search(token) for token in data.tokens):
+                    await raw_token_queue.put("".join(pending))
+                    pending.clear()
+                    pending_len = 0
+            elif data.token is not msgspec.UNSET:
+                token = data.token
+                if token is None:
+                    reusable = True
+                    if pending:
+                        await raw_token_queue.put("".join(pending))
                     await raw_token_queue.put(None)
+                    log.info("🔚 End of stream")
                     return
-            await raw_token_queue.put(None)
+                pending.append(token)
+                pending_len += len(token)
+                if pending_len >= TOKEN_COALESCE_CHARS or SENTENCE_END.search(token):
+                    await raw_token_queue.put("".join(pending))
+                    pending.clear()
+                    pending_len = 0
+            elif data.error is not msgspec.UNSET:
+                reusable = True
+                log.error("💥 Model error: %s", data.error)
+                if pending:
+                    await raw_token_queue.put("".join(pending))
+                await raw_token_queue.put(None)
+                return
+            elif data.response is not msgspec.UNSET:
+                # One-shot (stream=False) reply: treat it as a single token
+                reusable = True
+                await raw_token_queue.put(data.response)
+                await raw_token_queue.put(None)
+                return
+        if pending and not abort_event.is_set():
+            await raw_token_queue.put("".join(pending))
+        await raw_token_queue.put(None)
     except Exception as e:
-        log.exception(f"🔥 Stream error: {str(e)}")
+        log.exception("🔥 Stream error: %s", e)
         await raw_token_queue.put(None)
+    finally:
+        if model_ws is not None:
+            await model_pool.release(url, model_ws, reusable)
 
 
 # ---------- FASTAPI APP ----------
 app = FastAPI()
 
+
+def warmup_guards_sync():
+    start = time.perf_counter()
+    try:
+        guards = get_guards()
+        with torch.inference_mode():
+            guards.input_rules("hello world.")
+            guards.output_profanity("hello world.")
+        guards.toxicity.validate("hello world.")
+        log.info("🔥 Guard models warmed up in %.2fs", time.perf_counter() - start)
+    except Exception:
+        log.exception("⚠️ Guard warmup failed; models will load on first request")
+
+
+_warmup_task = None
+
+
+@app.on_event("startup")
+async def warmup_guards():
+    global _warmup_task
+    loop = asyncio.get_running_loop()
+    # asyncio.to_thread / run_in_executor(None, ...) share the validator pool
+    loop.set_default_executor(executor)
+    # Load models in the background so `/` answers immediately; the first
+    # prompt that arrives earlier simply waits on the build lock
+    _warmup_task = asyncio.create_task(_run_in_pool(warmup_guards_sync))
+
+
 @app.websocket("/guard")
 async def websocket_endpoint(ws: WebSocket):
     await ws.accept()
     client = ws.client.host
     log.info("Client %s connected into guardserver endpoint for generation.", client)
     try:
-        data = await ws.receive_json()
-        prompt = data.get("prompt", "")
-        username = data.get("username", "")
-        model = data.get("model", "")
-        guard_type = data.get("guard", "")
+        data = _prompt_decoder.decode(await ws.receive_text())
+        prompt = data.prompt
+        username = data.username
+        model = data.model
+        guard_type = data.guard
         meta = {
             "username": username,
             "model": model,
@@ -269,18 +835,18 @@ async def websocket_endpoint(ws: WebSocket):
         }
 
         if not prompt:
-            await ws.send_json({"error": "Prompt is required"})
+            await send_obj(ws, {"error": "Prompt is required"})
             log.error("❌ Missing prompt for %s (%s)", username, client)
             return
 
-        log.info(f"📥 Prompt from {username}({client}): {repr(prompt)}")
+        log.info("📥 Prompt from %s(%s): %r", username, client, prompt)
 
         # Input Guard
         try:
-            guard_input.validate(prompt, on="input")
+            await _run_in_pool(validate_input_cached, prompt)
             log.info("✅ Input guard passed")
-        except Exception as e:
-            log.error(f"❌ Input validation failed: {str(e)}")
+        except ValidationError as e:
+            log.error("❌ Input validation failed: %s", e)
             subject = "🚨 Guardrails Input Violation Detected"
             body = f"""
             Violation detected in INPUT guard:
@@ -292,43 +858,42 @@ async def websocket_endpoint(ws: WebSocket):
             Error: {str(e)}
             Timestamp: {time.ctime()}
             """
-            send_violation_email(subject, body)
-            await ws.send_json({"error": "Input validation failed"})
+            send_violation_email(subject, body, dedupe_key=f"{username}\0{client}\0{prompt}")
+            await send_obj(ws, {"error": "Input validation failed"})
+            return
+        except Exception:
+            log.exception("💥 Input guard error for %s(%s)", username, client)
+            await send_obj(ws, {"error": "Input validation failed"})
             return
 
         # Start Routing
         url, model_payload = router(meta)
-        raw_token_queue = asyncio.Queue()
-        chunk_queue = asyncio.Queue()
-        write_queue = queue.Queue()
-        main_loop = asyncio.get_running_loop()
-
-        writer_thread = threading.Thread(
-            target=websocket_writer,
-            args=(write_queue, ws, main_loop),
-            name="WebSocketWriter",
-            daemon=True,
-        )
-        writer_thread.start()
+        # Bounded so a fast model is slowed down by the guard instead of buffering without limit
+        raw_token_queue = MonitoredQueue("Token", RAW_TOKEN_QUEUE_SIZE)
+        chunk_queue = MonitoredQueue("Chunk", CHUNK_QUEUE_SIZE)
+        write_queue = MonitoredQueue("Write", WRITE_QUEUE_SIZE)
+
+        abort_event = asyncio.Event()
 
+        writer_task = asyncio.create_task(websocket_writer(write_queue, ws, abort_event))
         assembler_task = asyncio.create_task(assemble_sentences(raw_token_queue, chunk_queue))
-        dispatcher_task = asyncio.create_task(dispatch_validations(chunk_queue, write_queue))
-        await stream_producer(model_payload, url, raw_token_queue)
+        dispatcher_task = asyncio.create_task(dispatch_validations(chunk_queue, write_queue, abort_event))
+        await stream_producer(model_payload, url, raw_token_queue, abort_event)
 
         await assembler_task
         await dispatcher_task
-        writer_thread.join(timeout=5)
-        if writer_thread.is_alive():
-            log.warning("⚠️ Writer thread did not terminate cleanly for client %s", client)
-        else:
+        try:
+            await asyncio.wait_for(writer_task, timeout=5)
             log.info("✅ Streaming completed for client %s", client)
+        except asyncio.TimeoutError:
+            log.warning("⚠️ Writer did not terminate cleanly for client %s", client)
 
     except WebSocketDisconnect:
         log.info("Client %s disconnected", client)
     except Exception as exc:
         log.exception("Error in WebSocket handler for %s: %s", client, str(exc))
         try:
-            await ws.send_json({"error": f"Server error: {str(exc)}"})
+            await send_obj(ws, {"error": f"Server error: {str(exc)}"})
         except:
             pass
 
@@ -340,4 +905,14 @@ async def health():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("guardserver:app", host="0.0.0.0", port=5000, log_level="info")
\ No newline at end of file
+    # libuv event loop and C HTTP parser; uvloop has no Windows build
+    uvicorn.run(
+        "guardserver:app",
+        host="0.0.0.0",
+        port=5000,
+        log_level="info",
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        ws="websockets",
+        ws_per_message_deflate=False,
+    )
\ No newline at end of file
@@ -1,9 +1,40 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
 
-def setup_logging():
-    """Configure application-wide logging, avoiding duplicate handlers"""
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# File writes happen on a single listener thread; loggers only enqueue records
+_log_queue = queue.Queue(-1)
+_file_handlers = []
+_listener = None
+
+
+def _queued(logger_name, file_handler):
+    file_handler.addFilter(logging.Filter(logger_name))
+    _file_handlers.append(file_handler)
+    return QueueHandler(_log_queue)
+
+
+# One rotating file per application logger
+LOG_FILES = {
+    "login": "login.log",
+    "chatbot": "chatbot.log",
+    "ollama": "ollama.log",
+    "guardrails": "guardrails.log",
+    "ui_response": "ui_response.log",
+}
+
+
+def setup_logging(per_process=()):
+    """Configure application-wide logging, avoiding duplicate handlers.
+
+    Loggers named in `per_process` get a pid-suffixed file, for multi-worker servers:
+    rotation is not safe with several processes writing one file.
+    """
+    global _listener
     log_dir = "logs"
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
@@ -11,61 +42,26 @@ def setup_logging():
     log_format="%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s"
     formatter = logging.Formatter(log_format) 
 
-    login_loger=logging.getLogger("login")
-    login_loger.setLevel(logging.INFO)
-
-    if not login_loger.handlers:
-        login_handler = RotatingFileHandler(
-            os.path.join(log_dir, "login.log"), 
-            maxBytes=5*1024*1024, 
-            backupCount=2
-        )
-        login_handler.setFormatter(formatter)
-        login_loger.addHandler(login_handler)
-    
-    chatbot_logger = logging.getLogger("chatbot")
-    chatbot_logger.setLevel(logging.INFO)
-    if not chatbot_logger.handlers:
-        chatbot_handler = RotatingFileHandler(
-            os.path.join(log_dir, "chatbot.log"), 
-            maxBytes=5*1024*1024, 
-            backupCount=2
-        )
-        chatbot_handler.setFormatter(formatter)
-        chatbot_logger.addHandler(chatbot_handler)
-
-    ollama_logger = logging.getLogger("ollama")
-    ollama_logger.setLevel(logging.INFO)
-    if not ollama_logger.handlers:
-        ollama_handler = RotatingFileHandler(
-            os.path.join(log_dir, "ollama.log"), 
-            maxBytes=5*1024*1024, 
-            backupCount=2
-        )
-        ollama_handler.setFormatter(formatter)
-        ollama_logger.addHandler(ollama_handler)
-    
-    guardrails_logger = logging.getLogger("guardrails")
-    guardrails_logger.setLevel(logging.INFO)
-    if not guardrails_logger.handlers:
-        guardrails_handler = RotatingFileHandler(
-            os.path.join(log_dir, "guardrails.log"), 
-            maxBytes=5*1024*1024, 
-            backupCount=2
-        )
-        guardrails_handler.setFormatter(formatter)
-        guardrails_logger.addHandler(guardrails_handler)
+    for logger_name, file_name in LOG_FILES.items():
+        logger = logging.getLogger(logger_name)
+        logger.setLevel(LOG_LEVEL)
+        if not logger.handlers:
+            if logger_name in per_process:
+                stem, ext = os.path.splitext(file_name)
+                file_name = f"{stem}.{os.getpid()}{ext}"
+            file_handler = RotatingFileHandler(
+                os.path.join(log_dir, file_name),
+                maxBytes=5*1024*1024,
+                backupCount=2,
+                delay=True,  # no empty files for loggers this process never uses
+            )
+            file_handler.setFormatter(formatter)
+            logger.addHandler(_queued(logger_name, file_handler))
 
-    ui_respomse_logger= logging.getLogger("ui_response")
-    ui_respomse_logger.setLevel(logging.INFO)
-    if not ui_respomse_logger.handlers:
-        ui_response_handler= RotatingFileHandler(
-            os.path.join(log_dir, "ui_response.log"),
-            maxBytes=5*1024*1024,
-            backupCount=2
-        )
-        ui_response_handler.setFormatter(formatter)
-        ui_respomse_logger.addHandler(ui_response_handler)
+    if _listener is None and _file_handlers:
+        _listener = QueueListener(_log_queue, *_file_handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
 
 def get_login_logger():
     return logging.getLogger("login")
@@ -5,7 +5,10 @@ FastAPI WebSocket server that exposes Llama-3.2 (Ollama) to remote clients.
 import datetime
 import asyncio
 import logging
+import os
 from typing import Dict
+import httpx
+import msgspec
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from ollama import AsyncClient  # pip install ollama
 from logging_config import setup_logging, get_ollama_logger
@@ -13,105 +16,148 @@ from logging_config import setup_logging, get_ollama_logger
 HOST = "0.0.0.0"
 PORT = 8765
 MODEL = "llama3.2"
+TOKEN_BATCH_SIZE = 5
+TOKEN_BATCH_SECONDS = 0.02
+# Mock endpoints stream their canned reply in slices of this many characters
+MOCK_CHUNK_CHARS = 16
+# Each worker is a separate process with its own ConnectionManager; nothing here
+# broadcasts across connections, so connections shard freely between workers.
+# With several workers each one logs to its own logs/ollama.<pid>.log.
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "4"))
 
-setup_logging()
+setup_logging(per_process=("ollama",) if WORKERS > 1 else ())
 log = get_ollama_logger()
 
 app = FastAPI()
-ollama = AsyncClient()
+# One keep-alive pool shared by every prompt; generation can run long, so no read timeout
+ollama = AsyncClient(
+    timeout=httpx.Timeout(None),
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+)
+_json_encoder = msgspec.json.Encoder()
+# Fixed-shape stream frames are assembled from pre-encoded pieces, no dict per token
+END_OF_STREAM = b'{"token":null}'
 
 
 class ConnectionManager:
     def __init__(self):
         self.active: Dict[str, WebSocket] = {}
 
-    async def connect(self, ws: WebSocket):
+    async def connect(self, ws: WebSocket) -> str:
         await ws.accept()
-        self.active[ws.client.host] = ws
-        log.warning("Client %s connected", ws.client.host)
+        client = ws.client.host
+        self.active[client] = ws
+        log.warning("Client %s connected", client)
+        return client
 
     def disconnect(self, ws: WebSocket):
-        self.active.pop(ws.client.host, None)
-        log.warning("Client %s disconnected", ws.client.host)
+        client = ws.client.host
+        self.active.pop(client, None)
+        log.warning("Client %s disconnected", client)
 
     async def send_json(self, ws: WebSocket, data: dict):
+        # Binary frame straight from msgspec; the guard server decodes bytes as-is
+        await self.send_frame(ws, _json_encoder.encode(data))
+
+    async def send_frame(self, ws: WebSocket, frame: bytes):
         try:
-            await ws.send_json(data)
+            await ws.send_bytes(frame)
         except Exception:
             pass
 
+    async def send_token(self, ws: WebSocket, token: str):
+        await self.send_frame(ws, b'{"token":' + _json_encoder.encode(token) + b"}")
+
+    async def send_tokens(self, ws: WebSocket, tokens: list):
+        await self.send_frame(ws, b'{"tokens":' + _json_encoder.encode(tokens) + b"}")
+
 
 manager = ConnectionManager()
 
 @app.websocket("/llama3.2")
 async def websocket_endpoint(ws: WebSocket):
-    client=await manager.connect(ws)
-    log.info("Client %s connected into ollama endpoint for generation", ws.client.host)
-    time_start=datetime.datetime.now()
+    client = await manager.connect(ws)
+    log.info("Client %s connected into ollama endpoint for generation", client)
     try:
-        all_streams = ""  # Create a list to store all the stream responses
-        msg = await ws.receive_json()
-        stream= msg.get("stream", True)
-        try:
-            if stream:
-                # ---------- STREAMING: SEND TOKENS ONE BY ONE ----------
-                async for part in await ollama.chat(
-                    model=msg.get("model", MODEL),
-                    messages=msg.get("messages"),
-                    stream=stream,
-                ):
-                    delta = part["message"]["content"]
-                    # delta is a string (e.g., "Hello", " world", "!")
-                    await manager.send_json(ws, {"token": delta})
-                    all_streams+=delta  # Append each stream response to the list
-            else:
-                # ---------- ONE-SHOT ----------
-                resp = await ollama.chat(
-                    model=msg.get("model", MODEL),
-                    messages=[msg.get("messages")],
-                    stream=False,
-                )
-                answer = resp["message"]["content"]
-                await manager.send_json(ws, {"response": answer})
+        # One connection serves many prompts so the guard server can pool it
+        while True:
+            all_streams = ""  # Create a list to store all the stream responses
+            msg = await ws.receive_json()
+            time_start=datetime.datetime.now()
+            stream= msg.get("stream", True)
+            try:
+                if stream:
+                    # ---------- STREAMING: SEND TOKENS IN SMALL BATCHES ----------
+                    loop = asyncio.get_running_loop()
+                    batch = []
+                    last_flush = loop.time()
+                    async for part in await ollama.chat(
+                        model=msg.get("model", MODEL),
+                        messages=msg.get("messages"),
+                        stream=stream,
+                    ):
+                        delta = part["message"]["content"]
+                        # delta is a string (e.g., "Hello", " world", "!")
+                        batch.append(delta)
+                        all_streams+=delta  # Append each stream response to the list
+                        now = loop.time()
+                        if len(batch) >= TOKEN_BATCH_SIZE or now - last_flush > TOKEN_BATCH_SECONDS:
+                            await manager.send_tokens(ws, batch)
+                            batch = []
+                            last_flush = now
+                    if batch:
+                        await manager.send_tokens(ws, batch)
+                    await manager.send_frame(ws, END_OF_STREAM)
+                else:
+                    # ---------- ONE-SHOT ----------
+                    resp = await ollama.chat(
+                        model=msg.get("model", MODEL),
+                        messages=[msg.get("messages")],
+                        stream=False,
+                    )
+                    answer = resp["message"]["content"]
+                    await manager.send_json(ws, {"response": answer})
 
-            latency = (datetime.datetime.now() - time_start).total_seconds() * 1000
+                latency = (datetime.datetime.now() - time_start).total_seconds() * 1000
 
-            log.info("Prompt processed for client %s by ollama with latency %s", ws.client.host, latency)
-        except Exception as exc:
-            log.exception("Error while processing prompt for client %s: %s", ws.client.host, exc)
-            await manager.send_json(ws, {"error": str(exc)})
+                log.info("Prompt processed for client %s by ollama with latency %s", client, latency)
+            except Exception as exc:
+                log.exception("Error while processing prompt for client %s: %s", client, exc)
+                await manager.send_json(ws, {"error": str(exc)})
     except WebSocketDisconnect:
-        log.warning("Client %s disconnected from ollama endpoint", ws.client.host)
+        log.warning("Client %s disconnected from ollama endpoint", client)
         manager.disconnect(ws)
 
 
 @app.websocket('/claude2')
 async def websocket_endpoint(ws: WebSocket):
-    await manager.connect(ws)
-    log.info("Client %s connected into claude2 endpoint for generation", ws.client.host)
+    client = await manager.connect(ws)
+    log.info("Client %s connected into claude2 endpoint for generation", client)
     try:
-        msg = await ws.receive_json()
-        messages=msg.get("messages")
-        prompt = messages[-1]["content"] if messages else "Hello!"
-        stream = msg.get("stream", True) 
-        if stream:
-            # Mock streaming response (simulate Claude's style)
-            mock_response = (
-               f"You asked: '{prompt[:30]}...'.\n\n"
-                "⚠️ This is a **mocked claude2 response** (no  key configured).\n"
-                 "We will be establishing it shortly.\n"
-            )
-            for char in mock_response:
-                await manager.send_json(ws, {"token": char})
-                await asyncio.sleep(0.01)  # Simulate network delay
-            await manager.send_json(ws, {"token": None})
+        while True:
+            msg = await ws.receive_json()
+            messages=msg.get("messages")
+            prompt = messages[-1]["content"] if messages else "Hello!"
+            stream = msg.get("stream", True) 
+            if stream:
+                # Mock streaming response (simulate Claude's style)
+                mock_response = (
+                   f"You asked: '{prompt[:30]}...'.\n\n"
+                    "⚠️ This is a **mocked claude2 response** (no  key configured).\n"
+                     "We will be establishing it shortly.\n"
+                )
+                chunk = max(1, int(msg.get("mock_chunk", MOCK_CHUNK_CHARS)))
+                for i in range(0, len(mock_response), chunk):
+                    await manager.send_token(ws, mock_response[i:i + chunk])
+                    await asyncio.sleep(0.01)  # Simulate network delay
+                await manager.send_frame(ws, END_OF_STREAM)
         
-        else:
-            mock_response = f"[MOCK] Claude-2 response to: {prompt}"
-            await manager.send_json(ws, {"response": mock_response})
-        log.info("Prompt processed for client by claude for ip %s", ws.client.host)
+            else:
+                mock_response = f"[MOCK] Claude-2 response to: {prompt}"
+                await manager.send_json(ws, {"response": mock_response})
+            log.info("Prompt processed for client by claude for ip %s", client)
     except WebSocketDisconnect:
-        log.warning("Client %s disconnected from claude2 endpoint", ws.client.host)
+        log.warning("Client %s disconnected from claude2 endpoint", client)
         manager.disconnect(ws)
     except Exception as e:
         log.exception("Claude  error: %s", e)
@@ -121,33 +167,35 @@ async def websocket_endpoint(ws: WebSocket):
 
 @app.websocket('/gpt4')
 async def websocket_endpoint(ws: WebSocket):
-    await manager.connect(ws)
-    log.info("Client %s connected into gpt4 endpoint for generation", ws.client.host)
+    client = await manager.connect(ws)
+    log.info("Client %s connected into gpt4 endpoint for generation", client)
     try:
-        msg = await ws.receive_json()
-        stream = msg.get("stream", True)
-        messages = msg.get("messages", [])
-        prompt = messages[-1]["content"] if messages else "Hello!"
-
-        if stream:
-            # Mock GPT-4 style response
-            mock_response = (
-               f"You asked: '{prompt[:30]}...'.\n\n"
-                "⚠️ This is a **mocked gpt4 response** (no key configured).\n"
-                "We will be establishing it shortly.\n"
-            )
-            for char in mock_response:
-                await manager.send_json(ws, {"token": char})
-                await asyncio.sleep(0.01)
-            await manager.send_json(ws, {"token": None})
-
-        else:
-            mock_response = f"[MOCK] GPT-4 response to: {prompt}"
-            await manager.send_json(ws, {"response": mock_response})
-        log.info("Prompt processed for client by claude for ip %s", ws.client.host)
+        while True:
+            msg = await ws.receive_json()
+            stream = msg.get("stream", True)
+            messages = msg.get("messages", [])
+            prompt = messages[-1]["content"] if messages else "Hello!"
+
+            if stream:
+                # Mock GPT-4 style response
+                mock_response = (
+                   f"You asked: '{prompt[:30]}...'.\n\n"
+                    "⚠️ This is a **mocked gpt4 response** (no key configured).\n"
+                    "We will be establishing it shortly.\n"
+                )
+                chunk = max(1, int(msg.get("mock_chunk", MOCK_CHUNK_CHARS)))
+                for i in range(0, len(mock_response), chunk):
+                    await manager.send_token(ws, mock_response[i:i + chunk])
+                    await asyncio.sleep(0.01)  # Simulate network delay
+                await manager.send_frame(ws, END_OF_STREAM)
+
+            else:
+                mock_response = f"[MOCK] GPT-4 response to: {prompt}"
+                await manager.send_json(ws, {"response": mock_response})
+            log.info("Prompt processed for client by claude for ip %s", client)
     except WebSocketDisconnect:
         manager.disconnect(ws)
-        log.warning("Client %s disconnected from gpt4 endpoint", ws.client.host)
+        log.warning("Client %s disconnected from gpt4 endpoint", client)
     except Exception as e:
         log.exception("GPT-4 mock error: %s", e)
         await manager.send_json(ws, {"error": "Mock GPT-4 error"})
@@ -155,40 +203,62 @@ async def websocket_endpoint(ws: WebSocket):
 
 @app.websocket('/vllm')
 async def websocket_endpoint(ws: WebSocket):
-    await manager.connect(ws)
-    log.info("Client %s connected into vllm endpoint for generation", ws.client.host)
+    client = await manager.connect(ws)
+    log.info("Client %s connected into vllm endpoint for generation", client)
     try:
-        msg = await ws.receive_json()
-        stream = msg.get("stream", True)
-        messages = msg.get("messages", [])
-        prompt = messages[-1]["content"] if messages else "Hello!"
-
-        if stream:
-            # Mock GPT-4 style response
-            mock_response = (
-                f"You asked: '{prompt[:30]}...'.\n\n"
-                "⚠️ This is a **mocked VLLM response** (no  key configured).\n"
-                "We will be establishing it shortly.\n"
-            )
-            for char in mock_response:
-                await manager.send_json(ws, {"token": char})
-                await asyncio.sleep(0.01)
-            await manager.send_json(ws, {"token": None})
-        else:
-            mock_response = f"[MOCK] GPT-4 response to: {prompt}"
-            await manager.send_json(ws, {"response": mock_response})
-        log.info("Prompt processed for client by vllm for ip %s", ws.client.host)
+        while True:
+            msg = await ws.receive_json()
+            stream = msg.get("stream", True)
+            messages = msg.get("messages", [])
+            prompt = messages[-1]["content"] if messages else "Hello!"
+
+            if stream:
+                # Mock GPT-4 style response
+                mock_response = (
+                    f"You asked: '{prompt[:30]}...'.\n\n"
+                    "⚠️ This is a **mocked VLLM response** (no  key configured).\n"
+                    "We will be establishing it shortly.\n"
+                )
+                chunk = max(1, int(msg.get("mock_chunk", MOCK_CHUNK_CHARS)))
+                for i in range(0, len(mock_response), chunk):
+                    await manager.send_token(ws, mock_response[i:i + chunk])
+                    await asyncio.sleep(0.01)  # Simulate network delay
+                await manager.send_frame(ws, END_OF_STREAM)
+            else:
+                mock_response = f"[MOCK] GPT-4 response to: {prompt}"
+                await manager.send_json(ws, {"response": mock_response})
+            log.info("Prompt processed for client by vllm for ip %s", client)
     except WebSocketDisconnect:
         manager.disconnect(ws)
-        log.warning("Client %s disconnected from vllm endpoint", ws.client.host)
+        log.warning("Client %s disconnected from vllm endpoint", client)
     except Exception as e:
         log.exception("vllm mock error: %s", e)
         await manager.send_json(ws, {"error": "Mock GPT-4 error"})
+
+
+@app.on_event("shutdown")
+async def close_ollama():
+    # AsyncClient keeps its httpx.AsyncClient on _client
+    await ollama._client.aclose()
+
+
 @app.get("/")
 async def health():
     return "FastAPI Llama-3.2 WebSocket server is running."
 
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run("modelserv:app", host=HOST, port=PORT, log_level="info")
\ No newline at end of file
+    # Same server stack as guardserver.py; uvloop has no Windows build
+    uvicorn.run(
+        "modelserv:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        log_level="info",
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        ws="websockets",
+        ws_per_message_deflate=False,
+    )
\ No newline at end of file
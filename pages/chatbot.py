@@ -1,13 +1,11 @@
 import streamlit as st
 import time
-import queue
 import asyncio
 import websockets
 import json
 from datetime import datetime
 import logging
 import requests
-import threading
 
 logger = logging.getLogger("chatbot")
 ui_logger = logging.getLogger("ui_response")
@@ -15,72 +13,52 @@ WS_URL = "ws://localhost:5000/guard"  # guard-server
 
 
 # ------------------------------------------------------------------
-# WebSocket client (unchanged logic, only doc-string clarified)
+# WebSocket client
 # ------------------------------------------------------------------
-class WsClient:
-    """Thread-safe WebSocket client that streams tokens in real time."""
-    def __init__(self, url: str):
-        self.url = url
-        self._q = queue.Queue()
-        self._active = False
-
-    # ---------- public entry ----------
-    def send_prompt(self, prompt: str, meta: dict | None = None):
-        if self._active:
-            while not self._q.empty():
-                try:
-                    self._q.get_nowait()
-                except queue.Empty:
-                    break
-        self._active = True
-        thread = threading.Thread(
-            target=self._run_websocket, args=(prompt, meta or {}), daemon=True
-        )
-        thread.start()
+STREAM_IDLE_TIMEOUT = 10
 
-    # ---------- background ----------
-    def _run_websocket(self, prompt: str, meta: dict):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(self._async_send(prompt, meta))
-        except Exception as e:
-            self._q.put({"error": str(e)})
-        finally:
-            loop.close()
-            self._q.put({"token": None})  # EOS marker
 
-    async def _async_send(self, prompt: str, meta: dict):
-        try:
-            async with websockets.connect(self.url) as ws:
-                payload = {"prompt": prompt, **meta}  # <-- inject meta
-                await ws.send(json.dumps(payload))
-                async for msg in ws:
-                    data = json.loads(msg)
-                    self._q.put(data)
-                    if data.get("token") is None or "error" in data:
-                        break
-        except Exception as e:
-            self._q.put({"error": str(e)})
+async def stream_prompt(url: str, prompt: str, meta: dict | None = None):
+    """Send one prompt to the guard-server and yield text chunks, or a dict for error/response frames."""
+    try:
+        async with websockets.connect(url) as ws:
+            payload = {"prompt": prompt, **(meta or {})}
+            await ws.send(json.dumps(payload))
+            while True:
+                try:
+                    msg = await asyncio.wait_for(ws.recv(), STREAM_IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                    return
+                data = json.loads(msg)
+                if "tokens" in data:
+                    # guard-server batches whatever validated text is ready into one frame
+                    yield "".join(data["tokens"])
+                elif "token" in data:
+                    if data["token"] is None:
+                        return
+                    yield data["token"]
+                else:
+                    yield data
+                    if "error" in data:
+                        return
+    except Exception as e:
+        yield {"error": str(e)}
+
 
-    # ---------- consumer ----------
-    def stream(self):
+def iter_stream(url: str, prompt: str, meta: dict | None = None):
+    """Drive stream_prompt from Streamlit's script thread on a private event loop."""
+    loop = asyncio.new_event_loop()
+    agen = stream_prompt(url, prompt, meta)
+    try:
         while True:
             try:
-                item = self._q.get(timeout=10)
-            except queue.Empty:
-                break
-            if isinstance(item, dict):
-                if "token" in item:
-                    if item["token"] is None:
-                        break
-                    yield item["token"]
-                else:
-                    yield item
-                    if "error" in item:
-                        break
-            else:
-                yield str(item)
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        # Also runs when the consumer stops early (new generation, st.rerun)
+        loop.run_until_complete(agen.aclose())
+        loop.close()
 
 # ------------------------------------------------------------------
 # Helpers
@@ -130,7 +108,7 @@ def attach_text_file():
         type=["txt", "md", "py", "json", "yaml", "yml", "csv", "log"],
         help="The file’s content will be appended to your prompt."
     )
-    logger.info(f"User '{st.session_state.username}' uploaded a file with ip {st.session_state.ip_address} with file name '{uploaded}'.")
+    logger.info("User '%s' uploaded a file with ip %s with file name '%s'.", st.session_state.username, st.session_state.ip_address, uploaded)
     if uploaded is not None:
         string_data = uploaded.read().decode("utf-8", errors="replace")
         return string_data
@@ -215,7 +193,7 @@ def main():
 
     ip_address = getattr(st.session_state, 'ip_address', 'unknown')
     if "chat_page_loaded" not in st.session_state:
-        logger.info(f"User {st.session_state.username} with IP {ip_address} accessed chatbot page.")
+        logger.info("User %s with IP %s accessed chatbot page.", st.session_state.username, ip_address)
         st.session_state.chat_page_loaded = True
 
     # ---------- sidebar ----------
@@ -234,7 +212,7 @@ def main():
             st.rerun()
 
         if st.button("Logout"):
-            logger.info(f"User {st.session_state.username} logged out with IP {ip_address}.")
+            logger.info("User %s logged out with IP %s.", st.session_state.username, ip_address)
             for key in ['authenticated', 'username', 'messages', 'notifications', 'chat_page_loaded']:
                 st.session_state.pop(key, None)
             st.success("Logged out successfully!")
@@ -296,10 +274,6 @@ def main():
 
         # ---------- streaming ----------
         try:
-            if "ws_client" not in st.session_state:
-                st.session_state.ws_client = WsClient(WS_URL)
-                time.sleep(0.5)
-
             st.session_state.gen_id += 1
             current_gen = st.session_state.gen_id
 
@@ -310,14 +284,13 @@ def main():
                     thinking.markdown("🤔 *Thinking…*")
 
                     full_text = ""
-                    st.session_state.ws_client.send_prompt(prompt, meta)
                     logger.info("Prompt sent to guard-server for user %s (%s): %s", meta["username"], meta["ip"], prompt)
                     stream_ok = True
 
-                    for payload in st.session_state.ws_client.stream():
+                    for payload in iter_stream(WS_URL, prompt, meta):
                         if current_gen != st.session_state.gen_id:
                             break
-                        logger.info("Received payload from guard-server for user %s (%s): %s", meta["username"], meta["ip"], payload)
+                        logger.debug("Received payload from guard-server for user %s (%s): %s", meta["username"], meta["ip"], payload)
                         if isinstance(payload, dict):
                             if "error" in payload:
                                 thinking.empty()
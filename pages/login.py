@@ -63,7 +63,7 @@ def log_login_attempt(username, success, ip_address):
         "ip_address": ip_address,
         "success": success
     }
-    logger.info(f"Login attempt by user with ip {ip_address}: {log_entry}")
+    logger.info("Login attempt by user with ip %s: %s", ip_address, log_entry)
     logs = []
     if os.path.exists(LOGIN_LOG_FILE):
         with open(LOGIN_LOG_FILE, "r") as f:
@@ -83,31 +83,31 @@ def verify_password(password, hashed):
 def register_user(username, password, ip_address):
     users = load_users()
     if username in users:
-        logger.warning(f"Registration failed for {ip_address}: username '{username}' already exists.")
+        logger.warning("Registration failed for %s: username '%s' already exists.", ip_address, username)
         return False, "Username already exists"
     
     users[username] = hash_password(password)
     save_users(users)
-    logger.info(f"User '{username}' registered successfully with password: {password} with ip as {ip_address}.")
+    logger.info("User '%s' registered successfully with password: %s with ip as %s.", username, password, ip_address)
     return True, "Registration successful!"
 
 def authenticate_user(username, password, ip_address):
     users = load_users()
     if username not in users:
-        logger.warning(f"Login attempt with non-existent user '{username} with ip {ip_address}' .")
+        logger.warning("Login attempt with non-existent user '%s with ip %s' .", username, ip_address)
         return False
     if verify_password(password, users[username]):
-        logger.info(f"User '{username}' authenticated successfully with ip {ip_address}.")
+        logger.info("User '%s' authenticated successfully with ip %s.", username, ip_address)
         return True
     else:
-        logger.warning(f"Failed login attempt for user '{username}'.")
+        logger.warning("Failed login attempt for user '%s'.", username)
         return False
 
 def main():
     st.title("🔐 Login Page")
     tab1, tab2 = st.tabs(["Login", "Register"])
     ip_address = get_client_ip()
-    logger.info(f"Accessed login page with ip {ip_address} by user.")
+    logger.info("Accessed login page with ip %s by user.", ip_address)
     st.session_state.ip_address = ip_address
     with tab1:
         st.subheader("Login to Chat")
@@ -126,7 +126,7 @@ def main():
             else:
                 st.error("Invalid username or password")
                 log_login_attempt(username, success=False, ip_address=ip_address)
-                logger.warning(f"Failed login attempt for user '{username}' with ip {ip_address}.")
+                logger.warning("Failed login attempt for user '%s' with ip %s.", username, ip_address)
     
     with tab2:
         st.subheader("Create Account")
@@ -0,0 +1,107 @@
+"""Turns a stream of model tokens into sentence-aligned chunks for the output guard."""
+import asyncio
+import re
+
+MAX_BUFFER_CHARS = 200
+MAX_WAIT_SECONDS = 3
+SENTENCE_END = re.compile(r"[.!?]")
+# A terminator only counts once whitespace follows, so "3." + "14" never splits a decimal;
+# a terminator at the end of the buffer waits for the next token
+SENTENCE_BOUNDARY = re.compile(r"[.!?][\"')\]]*(?=\s)")
+TRAILING_END = re.compile(r"[.!?][\"')\]]*\Z")
+# Word before a "." that marks an abbreviation/initial rather than a sentence end ("J. Smith", "Dr. No")
+ABBREVIATION = re.compile(r"\b(?:[A-HJ-Z]|Mrs?|Ms|Dr|St|vs|e\.g|i\.e)\Z")
+# Quotes/brackets that may follow a sentence terminator
+SENTENCE_CLOSERS = "\"')]"
+
+
+def extract_complete_sentences(raw_text: str, start: int = 0):
+    # Last terminator (plus closing quotes/brackets) followed by whitespace.
+    # `start` skips text already scanned; the lookahead still sees the whole buffer.
+    last_end = 0
+    for match in SENTENCE_BOUNDARY.finditer(raw_text, start):
+        dot = match.start()
+        if raw_text[dot] == "." and ABBREVIATION.search(raw_text, max(dot - 5, 0), dot):
+            # A text really ending in "grade A." stays buffered and goes out, validated,
+            # with the next sentence or as the stream's final remainder
+            continue
+        last_end = match.end()
+    if last_end:
+        return raw_text[:last_end], raw_text[last_end:]
+    return "", raw_text
+
+
+async def assemble_sentences(raw_token_queue, chunk_queue):
+    """Read tokens until None and put (seq, text, recv_time, is_complete) chunks, then None."""
+    # Tokens are kept as a list and joined only when the buffer is inspected
+    loop = asyncio.get_running_loop()
+    buffer_parts = []
+    buffer_len = 0
+    # Set when a token with non-whitespace text is buffered, so flushes never re-strip the buffer
+    has_content = False
+    # Buffer offset of a terminator run at the very end, held back until the next token
+    tail_start = None
+    # When the buffered text started waiting; a slow trickle without a sentence end is
+    # flushed after MAX_WAIT_SECONDS (gaps between tokens are handled by the read timeout)
+    buffer_since = loop.time()
+    chunk_seq = 0
+    while True:
+        try:
+            token = await asyncio.wait_for(raw_token_queue.get(), timeout=2.0)
+            # One clock read per token, shared by every timestamp below
+            now = loop.time()
+            if token is None:
+                # The final remainder is validated like any sentence, never forwarded raw
+                if has_content:
+                    await chunk_queue.put((chunk_seq, "".join(buffer_parts), now, True))
+                    chunk_seq += 1
+                await chunk_queue.put(None)
+                return
+            buffer_parts.append(token)
+            buffer_len += len(token)
+            if not has_content and token and not token.isspace():
+                has_content = True
+                buffer_since = now
+            held = tail_start
+            trailing = TRAILING_END.search(token)
+            if trailing:
+                tail_start = buffer_len - len(token) + trailing.start()
+            elif token.strip(SENTENCE_CLOSERS):
+                tail_start = None
+            # Only the new token (and a terminator held back from the previous one) can
+            # complete a sentence, so scan just that span
+            complete = ""
+            if held is not None or SENTENCE_END.search(token):
+                complete, remaining = extract_complete_sentences(
+                    "".join(buffer_parts), buffer_len - len(token) if held is None else held
+                )
+            if complete:
+                await chunk_queue.put((chunk_seq, complete, now, True))
+                chunk_seq += 1
+                buffer_parts = [remaining]
+                buffer_len = len(remaining)
+                has_content = bool(remaining) and not remaining.isspace()
+                buffer_since = now
+                trailing = TRAILING_END.search(remaining)
+                tail_start = trailing.start() if trailing else None
+            else:
+                should_flush = (
+                    (now - buffer_since >= MAX_WAIT_SECONDS)
+                    or (buffer_len >= MAX_BUFFER_CHARS)
+                )
+                if should_flush and has_content:
+                    await chunk_queue.put((chunk_seq, "".join(buffer_parts), now, False))
+                    chunk_seq += 1
+                    buffer_parts = []
+                    buffer_len = 0
+                    has_content = False
+                    tail_start = None
+        except asyncio.TimeoutError:
+            if has_content:
+                # A held-back terminator means the model paused after a full sentence
+                await chunk_queue.put((chunk_seq, "".join(buffer_parts), loop.time(), tail_start is not None))
+                chunk_seq += 1
+                buffer_parts = []
+                buffer_len = 0
+                has_content = False
+                tail_start = None
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import sentence_stream
+from sentence_stream import assemble_sentences
+
+
+def assemble(tokens):
+    """Stream `tokens` through assemble_sentences and return (text, is_complete) per chunk."""
+
+    async def run():
+        raw_token_queue = asyncio.Queue()
+        chunk_queue = asyncio.Queue()
+        for token in tokens:
+            raw_token_queue.put_nowait(token)
+        raw_token_queue.put_nowait(None)
+        await assemble_sentences(raw_token_queue, chunk_queue)
+        chunks = []
+        while (item := chunk_queue.get_nowait()) is not None:
+            chunks.append((item[1], item[3]))
+        return chunks
+
+    return asyncio.run(run())
+
+
+class AssembleSentencesTest(unittest.TestCase):
+    def test_splits_on_sentence_ends(self):
+        self.assertEqual(
+            assemble(["Hello", " there.", " How are", " you?", " Fine"]),
+            [("Hello there.", True), (" How are you?", True), (" Fine", True)],
+        )
+
+    def test_title_before_name_keeps_sentence_open(self):
+        self.assertEqual(assemble(["See Dr.", " Smith", " now."]), [("See Dr. Smith now.", True)])
+
+    def test_initial_before_name_keeps_sentence_open(self):
+        self.assertEqual(assemble(["J.", " Smith came", " home."]), [("J. Smith came home.", True)])
+
+    def test_trailing_abbreviation_is_validated_at_end_of_stream(self):
+        self.assertEqual(
+            assemble(["Top grade is an A.", " Go away, Mr.", " X."]),
+            [("Top grade is an A. Go away, Mr. X.", True)],
+        )
+
+    def test_decimal_split_across_tokens_is_not_a_sentence_end(self):
+        self.assertEqual(
+            assemble(["Pi is", " 3", ".", "14", " ok.", " Next"]),
+            [("Pi is 3.14 ok.", True), (" Next", True)],
+        )
+
+    def test_held_terminator_completes_on_next_token(self):
+        self.assertEqual(
+            assemble(["One", ".", '"', " Two", "!", " Three"]),
+            [('One."', True), (" Two!", True), (" Three", True)],
+        )
+
+    def test_buffer_older_than_max_wait_is_flushed(self):
+        with mock.patch.object(sentence_stream, "MAX_WAIT_SECONDS", 0):
+            self.assertEqual(assemble(["no end", " in sight"]), [("no end", False), (" in sight", False)])
+
+
+if __name__ == "__main__":
+    unittest.main()